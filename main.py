@@ -1,9 +1,172 @@
 import asyncio
+import functools
+import os
+import shutil
+import signal
+import sys
 from typing import Optional
-from mcp.server.fastmcp import FastMCP
+import anyio
+from mcp.server.fastmcp import Context, FastMCP
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 
 mcp = FastMCP("obsidianki-mcp-direct")
 
+# Resolved once so each run skips the PATH search; the bare name still finds a later install
+_OBSIDIANKI = shutil.which("obsidianki") or "obsidianki"
+_BASE_CMD = (_OBSIDIANKI, "--mcp")
+
+@functools.lru_cache(maxsize=32)
+def _build_command(
+    notes: tuple[str, ...],
+    cards: Optional[int],
+    query: Optional[str],
+    deck: Optional[str],
+    use_schema: bool
+) -> tuple[str, ...]:
+    """Build the obsidianki argv, reused across identical tool calls"""
+    cmd = list(_BASE_CMD)
+
+    if cards is not None:
+        cmd.extend(["--cards", str(cards)])
+
+    if query:
+        cmd.extend(["-q", query])
+
+    for note_pattern in notes:
+        cmd.extend(["--notes", note_pattern])
+
+    if deck:
+        cmd.extend(["--deck", deck])
+
+    if use_schema:
+        cmd.append("--use-schema")
+
+    return tuple(cmd)
+
+class _ObsidiankiProtocol(asyncio.SubprocessProtocol):
+    """Collects obsidianki's output straight from the pipe transports
+
+    Skips the StreamReader layer: each read from a pipe is appended to a
+    bytearray in one callback, with no per-read futures or reader tasks.
+    """
+
+    def __init__(self):
+        self.stdout = bytearray()
+        self.stderr = bytearray()
+        self.last_grown = self.stdout
+        self.changed = asyncio.Event()
+        self.done = asyncio.get_running_loop().create_future()
+        self._open_pipes = {1, 2}
+        self._exited = False
+
+    def pipe_data_received(self, fd, data):
+        self.last_grown = self.stdout if fd == 1 else self.stderr
+        self.last_grown.extend(data)
+        self.changed.set()
+
+    def last_line(self) -> bytes:
+        """The last complete, non-blank line of whichever pipe wrote most recently
+
+        Pipe reads don't follow line boundaries, so a trailing partial line is
+        ignored. Only a bounded tail is searched, so long outputs stay cheap.
+        """
+        buf = self.last_grown
+        end = buf.rfind(b"\n", max(0, len(buf) - 4096))
+        if end < 0:
+            return b""
+        complete = buf[max(0, end - 4096):end].rstrip()
+        return complete.rpartition(b"\n")[2].strip()
+
+    def pipe_connection_lost(self, fd, exc):
+        self._open_pipes.discard(fd)
+        self._check_done()
+
+    def process_exited(self):
+        self._exited = True
+        self._check_done()
+
+    def _check_done(self):
+        # Output is complete only once the process has exited and both pipes hit EOF
+        if self._exited and not self._open_pipes and not self.done.done():
+            self.done.set_result(None)
+            self.changed.set()
+
+def _kill_process_group(transport: asyncio.SubprocessTransport) -> None:
+    """Kill obsidianki along with any subprocesses it started"""
+    if sys.platform == "win32":
+        transport.kill()
+        return
+    try:
+        # obsidianki leads its own session, so its pid is also the group id
+        os.killpg(transport.get_pid(), signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+async def _run_obsidianki(cmd: tuple[str, ...], ctx: Context) -> str:
+    """Run obsidianki once, relaying its progress to ctx, and format the result"""
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.subprocess_exec(
+        _ObsidiankiProtocol,
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        stdin=asyncio.subprocess.DEVNULL,
+        # Not preexec_fn=os.setsid: that would force fork() instead of vfork() on Linux
+        start_new_session=True
+    )
+
+    async def relay_output():
+        reported = 0
+        while not protocol.done.done():
+            # Only give up once obsidianki has gone quiet, so long runs that
+            # keep producing output are not cut off
+            await asyncio.wait_for(protocol.changed.wait(), timeout=60.0)
+            protocol.changed.clear()
+            received = len(protocol.stdout) + len(protocol.stderr)
+            if received > reported:
+                reported = received
+                # Surface the latest line so the client sees progress before the run ends;
+                # only that line is decoded, not the whole buffer
+                latest = protocol.last_line().decode(errors="replace")
+                await ctx.report_progress(received, message=latest or None)
+
+    def collect_output():
+        # Clean up lines as bytes and decode the result once
+        lines = (
+            line.strip()
+            for buf in (protocol.stdout, protocol.stderr)
+            for line in buf.splitlines()
+        )
+        return b"\n".join(line for line in lines if line).decode(errors="replace")
+
+    # Wait for process to complete, timing out on inactivity
+    try:
+        await relay_output()
+
+        result = collect_output() or "No output"
+        return f"{result}\n\nProcess completed with exit code: {transport.get_returncode()}"
+
+    except asyncio.TimeoutError:
+        _kill_process_group(transport)
+        # Bounded: a descendant that left the group may still hold the pipes open
+        await asyncio.wait([protocol.done], timeout=5.0)
+        result = collect_output() or "No output captured"
+        return f"TIMEOUT after 60s without output\n\nOutput before timeout:\n{result}"
+
+    finally:
+        unfinished = not protocol.done.done()
+        transport.close()
+        if unfinished:
+            # close() only kills obsidianki itself (e.g. when the call is cancelled), so
+            # kill its children too. This comes after close() because signalling first lets
+            # close()'s poll() reap the leader before asyncio's child watcher does, which
+            # makes asyncio report a spurious exit code 255.
+            _kill_process_group(transport)
+
 @mcp.prompt()
 def instructions() -> str:
     """Instructions for using the flashcard generation tool"""
@@ -20,6 +183,7 @@ Example: "I've created 5 flashcards about Python list comprehensions and added t
 
 @mcp.tool()
 async def generate_flashcards(
+    ctx: Context,
     notes: Optional[list] = None,
     cards: Optional[int] = None,
     query: Optional[str] = None,
@@ -36,74 +200,18 @@ async def generate_flashcards(
         use_schema: If true, uses existing cards from the deck to match specific card format (--use-schema flag)
     """
     try:
-        cmd = ["obsidianki", "--mcp"]
-
-        if cards is not None:
-            cmd.extend(["--cards", str(cards)])
-
-        if query:
-            cmd.extend(["-q", query])
+        cmd = _build_command(tuple(notes or ()), cards, query, deck, use_schema)
 
-        if notes:
-            for note_pattern in notes:
-                cmd.extend(["--notes", note_pattern])
-
-        if deck:
-            cmd.extend(["--deck", deck])
-
-        if use_schema:
-            cmd.append("--use-schema")
-
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-            stdin=asyncio.subprocess.PIPE
-        )
-
-        process.stdin.close()
-
-        output_lines = []
-
-        async def read_output():
-            while True:
-                line = await process.stdout.readline()
-                if not line:
-                    break
-                decoded = line.decode().strip()
-                if decoded:
-                    output_lines.append(decoded)
-
-        async def read_error():
-            while True:
-                line = await process.stderr.readline()
-                if not line:
-                    break
-                decoded = line.decode().strip()
-                if decoded:
-                    output_lines.append(decoded)
-
-        # Start reading tasks
-        read_task = asyncio.create_task(read_output())
-        error_task = asyncio.create_task(read_error())
-
-        # Wait for process to complete with timeout
-        try:
-            await asyncio.wait_for(process.wait(), timeout=60.0)
-            await read_task
-            await error_task
-
-            result = "\n".join(output_lines) if output_lines else "No output"
-            return f"{result}\n\nProcess completed with exit code: {process.returncode}"
-
-        except asyncio.TimeoutError:
-            process.kill()
-            await process.wait()
-            result = "\n".join(output_lines) if output_lines else "No output captured"
-            return f"TIMEOUT after 60s\n\nOutput before timeout:\n{result}"
+        return await _run_obsidianki(cmd, ctx)
 
+    except FileNotFoundError:
+        return "Error: obsidianki was not found; make sure it is installed and in PATH"
     except Exception as e:
         return f"Error: {str(e)}"
 
+def main() -> None:
+    """Run the server over stdio, on uvloop when it is installed"""
+    anyio.run(mcp.run_stdio_async, backend_options={"use_uvloop": uvloop is not None})
+
 if __name__ == "__main__":
-    mcp.run()
\ No newline at end of file
+    main()
\ No newline at end of file